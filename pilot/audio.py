@@ -0,0 +1,95 @@
+"""Voice clip preprocessing - trim silence and cap bitrate/duration before upload.
+
+The browser client does this itself when it can (live VAD + MediaRecorder
+bitrate) and sends the speech span it detected; such clips go to the model
+as they are. Otherwise this is the server-side pass: cut to the span, or
+find it with ffmpeg's silenceremove, then re-encode to low-bitrate mono
+Opus. Without ffmpeg clips pass through.
+"""
+import asyncio
+import logging
+import shutil
+from config import AUDIO_BITRATE, AUDIO_MAX_SECONDS, AUDIO_SILENCE_DB
+
+logger = logging.getLogger("pilot.audio")
+
+FFMPEG = shutil.which("ffmpeg")
+
+# Keep a little padding so word onsets/endings aren't clipped
+PAD_SECONDS = 0.2
+# A client clip whose span would lose less than this is sent as-is; the
+# browser already stops ~1.5s after speech, so re-encoding saves little
+MIN_TRIM_SECONDS = 2.0
+
+
+def ffmpeg_args(start_ms: int = None, end_ms: int = None) -> list[str]:
+    """Build the ffmpeg command line for one clip read from stdin."""
+    args = [FFMPEG or "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", "pipe:0"]
+    duration = AUDIO_MAX_SECONDS
+
+    if start_ms is not None or end_ms is not None:
+        # Client already found the speech, just cut to it. A single -t: ffmpeg
+        # ignores -to when -t is also given
+        start = max(0, (start_ms or 0) / 1000 - PAD_SECONDS)
+        if start:
+            args += ["-ss", f"{start:.3f}"]
+        if end_ms:
+            duration = min(duration, end_ms / 1000 + PAD_SECONDS - start)
+    else:
+        # Trim leading silence, then reverse and trim again for the tail
+        trim = (f"silenceremove=start_periods=1:start_threshold={AUDIO_SILENCE_DB}dB"
+                f":start_silence={PAD_SECONDS}")
+        args += ["-af", f"{trim},areverse,{trim},areverse"]
+
+    args += [
+        "-t", f"{duration:.3f}",
+        "-ac", "1",
+        "-c:a", "libopus",
+        "-b:a", str(AUDIO_BITRATE),
+        "-f", "webm",
+        "pipe:1",
+    ]
+    return args
+
+
+def client_clip_ok(start_ms: int = None, end_ms: int = None, duration_ms: int = None, bitrate: int = None) -> bool:
+    """True when the browser's clip is already within limits and barely trimmable."""
+    if None in (start_ms, end_ms, duration_ms, bitrate):
+        return False
+    if bitrate > AUDIO_BITRATE or duration_ms > AUDIO_MAX_SECONDS * 1000:
+        return False
+    cut = max(0, start_ms / 1000 - PAD_SECONDS) + max(0, duration_ms / 1000 - end_ms / 1000 - PAD_SECONDS)
+    return cut < MIN_TRIM_SECONDS
+
+
+async def preprocess(data: bytes, start_ms: int = None, end_ms: int = None,
+                     duration_ms: int = None, bitrate: int = None) -> bytes:
+    """Trim and re-encode a clip. Returns the original bytes on any failure.
+
+    Clips the client already capped and trimmed skip ffmpeg entirely.
+    """
+    if not FFMPEG or not data or client_clip_ok(start_ms, end_ms, duration_ms, bitrate):
+        return data
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *ffmpeg_args(start_ms, end_ms),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        out, err = await asyncio.wait_for(proc.communicate(data), timeout=10)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()  # reap it
+        logger.warning("ffmpeg timed out, sending original clip")
+        return data
+    except Exception as e:
+        logger.warning(f"ffmpeg failed: {e}")
+        return data
+
+    if proc.returncode != 0 or not out:
+        logger.warning(f"ffmpeg exit {proc.returncode}: {err.decode(errors='replace')[:200]}")
+        return data
+    # Re-encoding an already tight clip can come out larger
+    return out if len(out) < len(data) else data
@@ -0,0 +1,176 @@
+"""Micro-benchmarks for per-request hot paths, checked against stored baselines.
+
+    python -m pytest bench_pilot.py -q     # fail if anything regressed
+    python bench_pilot.py                  # print timings vs baseline
+    python bench_pilot.py --update         # re-record bench_baseline.json
+
+A benchmark fails when it is slower than baseline * PILOT_BENCH_THRESHOLD
+(default 2.0). Baselines are machine-specific; re-record after moving
+hardware, not to paper over a regression.
+"""
+import json
+import os
+import sys
+import tempfile
+import timeit
+from contextlib import contextmanager
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+BASELINE_FILE = Path(__file__).parent / "bench_baseline.json"
+THRESHOLD = float(os.getenv("PILOT_BENCH_THRESHOLD", "2.0"))
+
+# Realistic fixture: 20 sessions x 100 lines of mixed build/test/agent output
+SESSION_LINES = [
+    "tests/test_api.py::test_create_user PASSED                               [ 12%]",
+    "  File \"/home/dev/app/models.py\", line 214, in save",
+    "npm WARN deprecated inflight@1.0.6: This module is not supported",
+    "● Reading src/components/Dashboard.tsx (148 lines)",
+    "dev@box:~/app$ git status --short",
+    " M src/server/routes.py",
+    "Compiling pilot v0.1.0 (/home/dev/pilot)",
+    "",
+]
+SESSIONS = {
+    f"agent-{i}": "\n".join(SESSION_LINES[(i + j) % len(SESSION_LINES)] for j in range(100))
+    for i in range(20)
+}
+STATE = {"sessions": [{"name": name, "windows": ["0:bash", "1:vim", "2:logs"]} for name in SESSIONS]}
+LARGE_RESPONSE = json.dumps({
+    "commands": [{"target": f"agent-{i}:0", "keys": f"pytest tests/test_{i}.py -x -q"} for i in range(20)],
+    "display": "\n".join(f"agent-{i:<3} running  {SESSION_LINES[i % 7][:50]}" for i in range(60)),
+    "task": "Fix the failing integration tests across all agents and re-run the suite",
+    "note": "dispatched pytest to 20 agents",
+})
+
+
+def full_context() -> str:
+    """A context file at its steady-state size (header, state, full log)."""
+    lines = ["# Pilot Context", "_Updated: 12:00_", "", "## Current Task", "Ship the release", ""]
+    lines += ["## Recent Files"] + [f"- `src/module_{i}.py`" for i in range(10)] + [""]
+    lines += ["## Server State"] + [f"- **{s['name']}**: 0:bash, 1:vim, 2:logs" for s in STATE["sessions"]] + [""]
+    lines += ["## Activity Log"] + [f"- [11:{i:02d}] ran tests in agent-{i}, 3 failures" for i in range(40)]
+    return "\n".join(lines)
+
+
+def fake_tmux_run(cmd: str, host: str = None) -> str:
+    """Canned tmux output so parsing is timed, not subprocesses."""
+    import tmux
+    if "capture-pane" in cmd:
+        return "".join(f"{tmux.RECORD_SEP}{name}\n{content}\n" for name, content in SESSIONS.items())
+    return "\n".join(SESSIONS) + "\n"
+
+
+@contextmanager
+def bench_env():
+    """Point context at a full temp context file and stub out tmux.run."""
+    import context
+    import tmux
+    with tempfile.TemporaryDirectory() as d:
+        path = Path(d) / "context.md"
+        path.write_text(full_context())
+        with patch.object(context, "CONTEXT_FILE", path), patch.object(tmux, "run", fake_tmux_run):
+            yield
+
+
+@pytest.fixture
+def env():
+    with bench_env():
+        yield
+
+
+def bench_context_update():
+    import context
+    context.update(task="Ship the release", note="ran the full suite", state=STATE)
+
+
+def bench_context_save():
+    import context
+    context.save(full_context() * 3)
+
+
+def bench_build_prompt():
+    import gemini
+    gemini.build_prompt(
+        text="what is agent-7 doing",
+        screen={"cols": 48, "rows": 40},
+        tmux_screens=SESSIONS,
+        context=full_context(),
+        gps={"lat": 52.52, "lon": 13.405},
+    )
+
+
+def bench_list_sessions():
+    import tmux
+    tmux.list_sessions()
+
+
+def bench_capture_host_parse():
+    import tmux
+    tmux.capture_host("devbox")
+
+
+def bench_pilot_response():
+    import gemini
+    gemini.PilotResponse.model_validate_json(LARGE_RESPONSE).model_dump()
+
+
+BENCHMARKS = {
+    "context_update": bench_context_update,
+    "context_save": bench_context_save,
+    "build_prompt": bench_build_prompt,
+    "list_sessions": bench_list_sessions,
+    "capture_host_parse": bench_capture_host_parse,
+    "pilot_response": bench_pilot_response,
+}
+
+
+def measure(fn) -> float:
+    """Best per-call time in seconds over several timed batches."""
+    number, _ = timeit.Timer(fn).autorange()
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number
+
+
+def load_baseline() -> dict:
+    if BASELINE_FILE.exists():
+        return json.loads(BASELINE_FILE.read_text())
+    return {}
+
+
+@pytest.mark.parametrize("name", list(BENCHMARKS))
+def test_no_regression(name, env):
+    baseline = load_baseline().get(name)
+    if baseline is None:
+        pytest.skip(f"no baseline for {name}, run: python bench_pilot.py --update")
+    took = measure(BENCHMARKS[name])
+    for _ in range(2):
+        if took <= baseline * THRESHOLD:
+            break
+        took = min(took, measure(BENCHMARKS[name]))  # rule out a noisy batch
+    assert took <= baseline * THRESHOLD, (
+        f"{name}: {took * 1e6:.1f}us vs baseline {baseline * 1e6:.1f}us (limit {THRESHOLD}x)"
+    )
+
+
+def main(argv: list[str]):
+    update = "--update" in argv
+    baseline = load_baseline()
+    results = {}
+    with bench_env():
+        for name, fn in BENCHMARKS.items():
+            # Median of three so one lucky run doesn't set an unreachable bar
+            results[name] = float(f"{sorted(measure(fn) for _ in range(3))[1]:.3g}")
+            base = baseline.get(name)
+            ratio = f"{results[name] / base:.2f}x" if base else "new"
+            print(f"{name:<20} {results[name] * 1e6:10.1f}us  {ratio}")
+    if update:
+        BASELINE_FILE.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Wrote {BASELINE_FILE.name}")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -19,15 +19,53 @@ else:
 # Files
 CONTEXT_FILE = PILOT_HOME / "context.md"
 PROMPT_FILE = PILOT_HOME / "prompt.md"
+WATCH_FILE = PILOT_HOME / "watch.toml"
+
+# Background pane watchers (rules in WATCH_FILE)
+WATCH_INTERVAL = float(os.getenv("PILOT_WATCH_INTERVAL", "2.0"))  # seconds between polls
 
 # Server
 HOST = "127.0.0.1"  # Caddy will proxy
 PORT = int(os.getenv("PILOT_PORT", "7777"))
+WORKERS = max(1, int(os.getenv("PILOT_WORKERS", "1")))
+
+# Cross-worker coordination - flock files and the shared capture cache
+LOCK_DIR = PILOT_HOME / "locks"
+LOCK_DIR.mkdir(exist_ok=True)
+CAPTURE_CACHE_FILE = PILOT_HOME / "screens.json"
+CAPTURE_CACHE_GEN_FILE = PILOT_HOME / "screens.gen"  # bumped on every invalidation
+# Seconds workers share one capture, 0 = off. A single worker has nobody to
+# share with, so it always captures fresh
+CAPTURE_CACHE_TTL = float(os.getenv("PILOT_CAPTURE_CACHE_TTL", "1.0" if WORKERS > 1 else "0"))
 
 # Gemini - using flash for speed
 GEMINI_MODEL = "gemini-2.0-flash-exp"
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
 
+# Remote tmux hosts (ssh destinations, e.g. "devbox1,devbox2") - targets
+# on them are "host:session:window"; local targets stay "session:window"
+HOSTS = [h.strip() for h in os.getenv("PILOT_HOSTS", "").split(",") if h.strip()]
+SSH_CONTROL_DIR = PILOT_HOME / "ssh"
+SSH_CONTROL_DIR.mkdir(mode=0o700, exist_ok=True)
+SSH_CONTROL_PERSIST = os.getenv("PILOT_SSH_PERSIST", "10m")
+HOST_BACKOFF = float(os.getenv("PILOT_HOST_BACKOFF", "30"))  # seconds captures skip an unreachable host
+
+# Opt-in: pipe every pane into a memory-mapped ring buffer and capture from
+# that instead of running capture-pane (full history, no subprocess per pane)
+PANE_BUFFERS = os.getenv("PILOT_PANE_BUFFERS", "").lower() in ("1", "true", "yes")
+PANE_BUFFER_DIR = PILOT_HOME / "panes"
+PANE_BUFFER_DIR.mkdir(exist_ok=True)
+PANE_BUFFER_BYTES = int(os.getenv("PILOT_PANE_BUFFER_BYTES", str(1024 * 1024)))
+
+# Model admission control - shared by every client, split evenly across workers
+MODEL_MAX_CONCURRENCY = int(os.getenv("PILOT_MODEL_CONCURRENCY", "4"))
+MODEL_TOKENS_PER_MINUTE = int(os.getenv("PILOT_MODEL_TPM", "1000000"))  # 0 = unlimited
+
+# Voice clips - trimmed and re-encoded before they go to the model
+AUDIO_BITRATE = int(os.getenv("PILOT_AUDIO_BITRATE", "24000"))  # opus bits/sec
+AUDIO_MAX_SECONDS = float(os.getenv("PILOT_AUDIO_MAX_SECONDS", "30"))
+AUDIO_SILENCE_DB = int(os.getenv("PILOT_AUDIO_SILENCE_DB", "-45"))
+
 # Context limits (lines)
 CONTEXT_MAX_LINES = 60
 
@@ -3,6 +3,7 @@ import time
 from datetime import datetime
 from pathlib import Path
 from config import CONTEXT_FILE, CONTEXT_MAX_LINES
+from locks import file_lock, atomic_write
 
 def load() -> str:
     """Load current context."""
@@ -20,11 +21,20 @@ def save(content: str):
         tail = lines[-(CONTEXT_MAX_LINES - 5):]
         lines = header + ["", "... (truncated)", ""] + tail
 
-    CONTEXT_FILE.write_text('\n'.join(lines))
+    atomic_write(CONTEXT_FILE, '\n'.join(lines))
 
 
 def update(task: str = None, files: list[str] = None, note: str = None, state: dict = None):
-    """Update context with new information."""
+    """Update context with new information.
+
+    The read-modify-write runs under a cross-process lock so concurrent
+    workers don't drop each other's log entries.
+    """
+    with file_lock("context"):
+        _update(task, files, note, state)
+
+
+def _update(task: str = None, files: list[str] = None, note: str = None, state: dict = None):
     now = datetime.now().strftime("%H:%M")
 
     content = load()
@@ -6,11 +6,13 @@ from typing import Optional
 from google import genai
 from google.genai import types
 from config import GEMINI_API_KEY, GEMINI_MODEL, load_user_instructions
+import tmux
+from scheduler import scheduler, estimate_tokens, StaleRequest, INTERACTIVE
 
 
 class TmuxCommand(BaseModel):
     """A tmux command to execute."""
-    target: str = Field(default="", description="tmux target like 'session:window'")
+    target: str = Field(default="", description="tmux target like 'session:window' or 'host:session:window'")
     keys: str = Field(default="", description="keys/command to send")
 
 
@@ -54,32 +56,32 @@ def get_system_prompt() -> str:
     return f"{CORE_SCHEMA_INSTRUCTION}\n\n{user_instructions}"
 
 
-async def translate(
+def build_prompt(
     text: str = None,
-    audio_b64: str = None,
-    image_b64: str = None,
     screen: dict = None,
     tmux_screens: dict = None,
     context: str = None,
     gps: dict = None,
-) -> dict:
-    """Translate input to commands and generate display."""
-    if not client:
-        return {
-            "commands": [],
-            "display": "Error: GEMINI_API_KEY not set",
-            "task": None,
-            "note": "missing API key"
-        }
-
-    # Build prompt
+) -> str:
+    """Assemble the user prompt from screen size, tmux contents and context."""
     screen = screen or {"cols": 80, "rows": 24}
     prompt = f"Screen: {screen['cols']}x{screen['rows']} chars\n\n"
 
     if tmux_screens:
-        prompt += "=== TMUX SESSIONS ===\n"
-        for name, content in tmux_screens.items():
-            prompt += f"\n[{name}]\n{content}\n"
+        groups = tmux.group_by_host(tmux_screens)
+        if list(groups) == [""]:
+            prompt += "=== TMUX SESSIONS ===\n"
+            for name, content in tmux_screens.items():
+                prompt += f"\n[{name}]\n{content}\n"
+        else:
+            # Several machines: group per host so the model keeps them apart
+            prompt += "Targets on remote hosts are 'host:session:window'.\n\n"
+            for host, sessions in groups.items():
+                prompt += f"=== HOST {host or 'local'} ===\n"
+                for name, content in sessions.items():
+                    label = f"{host}:{name}" if host else name
+                    prompt += f"\n[{label}]\n{content}\n"
+                prompt += "\n"
         prompt += "\n"
 
     if context:
@@ -89,13 +91,42 @@ async def translate(
         prompt += f"Location: {gps['lat']:.4f}, {gps['lon']:.4f}\n\n"
 
     prompt += f"User: {text or '(voice/image input)'}"
+    return prompt
+
+
+async def translate(
+    text: str = None,
+    audio_b64: str = None,
+    image_b64: str = None,
+    screen: dict = None,
+    tmux_screens: dict = None,
+    context: str = None,
+    gps: dict = None,
+    priority: int = INTERACTIVE,
+    is_stale=None,
+) -> dict:
+    """Translate input to commands and generate display.
+
+    The model call waits its turn in the shared scheduler; raises
+    scheduler.StaleRequest if is_stale() turns true while queued.
+    """
+    if not client:
+        return {
+            "commands": [],
+            "display": "Error: GEMINI_API_KEY not set",
+            "task": None,
+            "note": "missing API key"
+        }
+
+    prompt = build_prompt(text, screen, tmux_screens, context, gps)
 
     parts = [types.Part.from_text(text=prompt)]
+    audio = base64.b64decode(audio_b64) if audio_b64 else b""
 
     # Add audio if present
-    if audio_b64:
+    if audio:
         parts.append(types.Part.from_bytes(
-            data=base64.b64decode(audio_b64),
+            data=audio,
             mime_type="audio/webm"
         ))
 
@@ -106,25 +137,30 @@ async def translate(
             mime_type="image/jpeg"
         ))
 
+    cost = estimate_tokens(prompt, len(audio), bool(image_b64), max_output=1000)
+
     try:
         logger.debug(f"Prompt length: {len(prompt)} chars")
-        response = await client.aio.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[types.Content(role="user", parts=parts)],
-            config=types.GenerateContentConfig(
-                system_instruction=get_system_prompt(),
-                temperature=0.1,
-                max_output_tokens=1000,
-                response_mime_type="application/json",
-                response_schema=PilotResponse,
+        async with scheduler.slot(priority, cost, is_stale):
+            response = await client.aio.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=[types.Content(role="user", parts=parts)],
+                config=types.GenerateContentConfig(
+                    system_instruction=get_system_prompt(),
+                    temperature=0.1,
+                    max_output_tokens=1000,
+                    response_mime_type="application/json",
+                    response_schema=PilotResponse,
+                )
             )
-        )
 
         # Parse with Pydantic for validation
         result = PilotResponse.model_validate_json(response.text).model_dump()
         logger.debug(f"Parsed: {len(result.get('commands', []))} commands")
         return result
 
+    except StaleRequest:
+        raise
     except Exception as e:
         logger.error(f"Gemini error: {e}", exc_info=True)
         return {
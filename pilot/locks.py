@@ -0,0 +1,86 @@
+"""Cross-process locks and atomic file writes, so several workers can share ~/.pilot."""
+import fcntl
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from config import LOCK_DIR
+
+
+def lock_path(name: str) -> Path:
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    return LOCK_DIR / f"{safe}.lock"
+
+
+@contextmanager
+def file_lock(name: str):
+    """Hold an exclusive flock named name across processes (and threads)."""
+    fd = os.open(lock_path(name), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+_tickets = itertools.count()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def fifo_lock(name: str, poll: float = 0.01):
+    """Exclusive lock granted in request order, across processes and threads.
+
+    Waiters queue in ~/.pilot/locks/<name>.queue (guarded by a short flock) and
+    poll until they are at the head. Entries of dead processes are skipped,
+    so a crashed worker can't wedge the queue.
+    """
+    queue_file = lock_path(name).with_suffix(".queue")
+    me = [os.getpid(), f"{threading.get_ident()}-{next(_tickets)}"]
+
+    def edit(fn):
+        with file_lock(name):
+            try:
+                before = json.loads(queue_file.read_text())
+            except (OSError, ValueError):
+                before = []
+            queue = [e for e in before if e[0] == os.getpid() or _alive(e[0])]
+            result = fn(queue)
+            # Polling the head changes nothing; only write when the queue moved
+            if queue != before:
+                atomic_write(queue_file, json.dumps(queue))
+            return result
+
+    edit(lambda q: q.append(me))
+    try:
+        while not edit(lambda q: q[0] == me):
+            time.sleep(poll)
+        yield
+    finally:
+        edit(lambda q: q.remove(me) if me in q else None)
+
+
+def atomic_write(path: Path, text: str, mode: int = 0o666):
+    """Write via temp file + rename so readers never see a partial file.
+
+    mode applies from creation (less the umask), so a private file is
+    never readable by others, even briefly.
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with open(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
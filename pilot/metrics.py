@@ -0,0 +1,52 @@
+"""In-process counters exposed at /metrics in Prometheus text format."""
+import threading
+
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_summaries: dict[str, list[float]] = {}  # name -> [count, sum, max]
+_gauges = {}  # name -> callable returning current value
+
+
+def inc(name: str, value: float = 1):
+    """Add to a counter."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, value: float):
+    """Record one sample of a summary (count/sum/max)."""
+    with _lock:
+        s = _summaries.setdefault(name, [0, 0.0, 0.0])
+        s[0] += 1
+        s[1] += value
+        s[2] = max(s[2], value)
+
+
+def gauge(name: str, fn):
+    """Register a gauge read at scrape time."""
+    _gauges[name] = fn
+
+
+def render() -> str:
+    """Render everything as Prometheus exposition text."""
+    out = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            out += [f"# TYPE {name} counter", f"{name} {value:g}"]
+        for name, (count, total, peak) in sorted(_summaries.items()):
+            out += [
+                f"# TYPE {name} summary",
+                f"{name}_count {count:g}",
+                f"{name}_sum {total:g}",
+                f"{name}_max {peak:g}",
+            ]
+    for name, fn in sorted(_gauges.items()):
+        out += [f"# TYPE {name} gauge", f"{name} {fn():g}"]
+    return "\n".join(out) + "\n"
+
+
+def reset():
+    """Clear counters and summaries (tests)."""
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
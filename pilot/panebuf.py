@@ -0,0 +1,183 @@
+"""Per-pane output ring buffers fed by tmux pipe-pane.
+
+Each pane's output is appended, ANSI-stripped, into a fixed-size
+memory-mapped file so captures are plain memory reads and history is not
+limited by tmux's history-limit. Run as a script this is the pipe-pane
+writer: `python panebuf.py FILE CAPACITY` with pane output on stdin.
+
+File layout (little-endian u64s):
+    header  magic, capacity, head (bytes ever written), lines (newlines ever written), slots
+    index   slots x offset of the byte after each newline, ring-indexed by line number
+    data    capacity bytes, absolute offset p lives at p % capacity
+
+The writer bumps head last, so readers treat it as the commit point and
+retry if the region they copied was overwritten meanwhile. Single writer
+per file.
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+
+MAGIC = b"PLTRING1"
+HEADER = struct.Struct("<8sQQQQ")
+OFFSET = struct.Struct("<Q")
+DEFAULT_SLOTS = 16384
+
+# CSI, OSC, DCS/PM/APC strings and two-byte escapes
+SEQUENCES = (
+    rb"\x1b\[[0-?]*[ -/]*[@-~]"
+    rb"|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)"
+    rb"|\x1b[PX^_][^\x1b]*\x1b\\"
+)
+ESCAPE_RE = re.compile(SEQUENCES + rb"|\x1b[@-Z\\-_]")
+# Everything above plus stray control chars (keeps \t and \n)
+ANSI_RE = re.compile(ESCAPE_RE.pattern + rb"|[\x00-\x08\x0b-\x1f\x7f]")
+# A finished escape at the end of a chunk. Unlike ESCAPE_RE, a bare string
+# introducer (ESC ] P X ^ _) or CSI introducer doesn't count
+COMPLETE_RE = re.compile(SEQUENCES + rb"|\x1b[@-OQ-WYZ\\]")
+STRING_START_RE = re.compile(rb"\x1b[\]PX^_]")
+# Carriage returns: CRLF is a newline; a bare CR (progress bars) redraws the
+# line, which in a stream is closest to starting a new one
+CR_RE = re.compile(rb"\r+\n?")
+MAX_PENDING = 4096
+
+
+class AnsiStripper:
+    """Strip escape sequences from a byte stream split at arbitrary points."""
+
+    def __init__(self):
+        self.pending = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        data = self.pending + chunk
+        self.pending = b""
+        # Hold back a trailing escape or OSC/DCS string that hasn't finished
+        # arriving, and a trailing CR that may be half of a CRLF
+        hold = len(data)
+        starts = list(STRING_START_RE.finditer(data))
+        if starts and not COMPLETE_RE.match(data, starts[-1].start()):
+            hold = starts[-1].start()
+        esc = data.rfind(b"\x1b", 0, hold)
+        if esc != -1 and not COMPLETE_RE.match(data, esc):
+            hold = esc
+        while hold and data[hold - 1:hold] == b"\r":
+            hold -= 1
+        if len(data) - hold < MAX_PENDING:
+            data, self.pending = data[:hold], data[hold:]
+        return ANSI_RE.sub(b"", CR_RE.sub(b"\n", data))
+
+
+class RingBuffer:
+    """A memory-mapped ring of pane output with a line index."""
+
+    def __init__(self, path, writable: bool = False):
+        self.path = str(path)
+        self._fd = os.open(self.path, os.O_RDWR if writable else os.O_RDONLY)
+        try:
+            size = os.fstat(self._fd).st_size
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(self._fd, size, access=access)
+        except Exception:
+            os.close(self._fd)
+            raise
+        magic, self.capacity, _, _, self.slots = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or size != self._data_at + self.capacity:
+            self.close()
+            raise ValueError(f"not a pane buffer: {self.path}")
+
+    @classmethod
+    def create(cls, path, capacity: int, slots: int = DEFAULT_SLOTS) -> "RingBuffer":
+        """(Re)initialize the file in place and open it for writing."""
+        fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            os.ftruncate(fd, HEADER.size + slots * OFFSET.size + capacity)
+            os.pwrite(fd, HEADER.pack(MAGIC, capacity, 0, 0, slots), 0)
+        finally:
+            os.close(fd)
+        return cls(path, writable=True)
+
+    @property
+    def _data_at(self) -> int:
+        return HEADER.size + self.slots * OFFSET.size
+
+    def _counters(self) -> tuple[int, int]:
+        _, _, head, lines, _ = HEADER.unpack_from(self._map, 0)
+        return head, lines
+
+    def _line_start(self, n: int) -> int:
+        """Offset where line n (0-based) begins; only valid for indexed lines."""
+        if n <= 0:
+            return 0
+        return OFFSET.unpack_from(self._map, HEADER.size + ((n - 1) % self.slots) * OFFSET.size)[0]
+
+    def append(self, data: bytes):
+        """Append bytes, indexing every newline."""
+        if not data:
+            return
+        head, lines = self._counters()
+        if len(data) > self.capacity:
+            head += len(data) - self.capacity
+            data = data[-self.capacity:]
+
+        pos = head % self.capacity
+        first = min(len(data), self.capacity - pos)
+        base = self._data_at
+        self._map[base + pos:base + pos + first] = data[:first]
+        if first < len(data):
+            self._map[base:base + len(data) - first] = data[first:]
+
+        nl = data.find(b"\n")
+        while nl != -1:
+            OFFSET.pack_into(self._map, HEADER.size + (lines % self.slots) * OFFSET.size, head + nl + 1)
+            lines += 1
+            nl = data.find(b"\n", nl + 1)
+
+        HEADER.pack_into(self._map, 0, MAGIC, self.capacity, head + len(data), lines, self.slots)
+
+    def _read(self, start: int, end: int) -> bytes:
+        base = self._data_at
+        a, b = start % self.capacity, end % self.capacity
+        if end - start == self.capacity or (a >= b and end > start):
+            return self._map[base + a:base + self.capacity] + self._map[base:base + b]
+        return self._map[base + a:base + b]
+
+    def tail(self, n: int) -> str:
+        """Last n lines (the unterminated current line counts as one)."""
+        for _ in range(3):
+            head, lines = self._counters()
+            oldest = max(0, head - self.capacity)
+            current = self._line_start(lines) if lines else 0
+            # Skip an empty trailing line so n counts real content
+            first = lines - n + (1 if current < head else 0)
+            if first > 0 and lines - first >= self.slots:
+                first = 0  # index has wrapped past it
+            start = self._line_start(max(0, first))
+            clipped = start < oldest
+            data = self._read(max(start, oldest), head)
+
+            if self._counters()[0] - self.capacity > max(start, oldest):
+                continue  # writer lapped us mid-copy
+            if clipped:
+                # Drop the partial line the ring cut through
+                data = data[data.find(b"\n") + 1:]
+            return data.decode(errors="replace")
+        return ""
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def main(argv: list[str]):
+    path, capacity = argv[1], int(argv[2])
+    ring = RingBuffer.create(path, capacity)
+    stripper = AnsiStripper()
+    while chunk := os.read(0, 65536):
+        ring.append(stripper.feed(chunk))
+    ring.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,156 @@
+"""Process-wide admission control for model calls.
+
+Every call into Gemini goes through one scheduler so a burst from a single
+client can't starve the others or blow through the API rate limits.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from config import MODEL_MAX_CONCURRENCY, MODEL_TOKENS_PER_MINUTE, WORKERS
+
+logger = logging.getLogger("pilot.scheduler")
+
+# Priority classes - lower runs first
+INTERACTIVE = 0  # voice/text commands from a connected client
+BACKGROUND = 1   # watchers, summaries nobody is waiting on
+
+
+class StaleRequest(Exception):
+    """Raised when a queued request is dropped before it reached the model."""
+
+
+class Scheduler:
+    """Bounded concurrency + token bucket + priority queue.
+
+    Waiters are admitted in (priority, arrival) order. A waiter whose
+    is_stale() returns True is discarded instead of admitted.
+    """
+
+    def __init__(self, max_concurrency: int = 4, tokens_per_minute: int = 0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.active = 0
+        self.dropped = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled = time.monotonic()
+        self._queue = []  # heap of (priority, seq, cost, future, is_stale)
+        self._seq = itertools.count()
+        self._timer = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for entry in self._queue if not entry[3].done())
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        rate = self.tokens_per_minute / 60
+        self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+
+    def _purge_stale(self):
+        """Fail waiters that are no longer wanted so they stop holding a place."""
+        for entry in self._queue:
+            fut, is_stale = entry[3], entry[4]
+            if not fut.done() and is_stale and is_stale():
+                fut.set_exception(StaleRequest())
+                self.dropped += 1
+        self._queue = [e for e in self._queue if not e[3].done()]
+        heapq.heapify(self._queue)
+
+    def _dispatch(self):
+        self._timer = None
+        self._purge_stale()
+        while self._queue and self.active < self.max_concurrency:
+            priority, seq, cost, fut, is_stale = self._queue[0]
+            if self.tokens_per_minute:
+                self._refill()
+                cost = min(cost, self.tokens_per_minute)
+                if self._tokens < cost:
+                    # Wake up once enough budget has trickled back in
+                    wait = (cost - self._tokens) / (self.tokens_per_minute / 60)
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                    return
+                self._tokens -= cost
+            heapq.heappop(self._queue)
+            self.active += 1
+            fut.set_result(None)
+
+    def wake(self):
+        """Re-check the queue, e.g. after a client went away."""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def acquire(self, priority: int = INTERACTIVE, cost: int = 0, is_stale=None):
+        """Wait for a slot. Raises StaleRequest if dropped while queued."""
+        if is_stale and is_stale():
+            self.dropped += 1
+            raise StaleRequest()
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), cost, fut, is_stale))
+        self.wake()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release()  # admitted just as we were cancelled
+            else:
+                fut.cancel()
+                self.wake()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, cost: int = 0, is_stale=None):
+        """Hold a model slot for the duration of the block."""
+        start = time.monotonic()
+        await self.acquire(priority, cost, is_stale)
+        waited = time.monotonic() - start
+        if waited > 0.5:
+            logger.info(f"Model call queued {waited:.1f}s (priority={priority}, cost={cost})")
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def estimate_tokens(prompt: str, audio_bytes: int = 0, image: bool = False, max_output: int = 0) -> int:
+    """Rough token cost of a request, for rate budgeting only."""
+    tokens = len(prompt) // 4 + max_output
+    if audio_bytes:
+        # ~32 tokens per second of audio, webm/opus runs ~4KB per second
+        tokens += audio_bytes // 125
+    if image:
+        tokens += 258
+    return tokens
+
+
+def worker_share(total: int, workers: int) -> int:
+    """This worker's slice of a limit, so all workers together stay within it.
+
+    0 means unlimited and stays 0. Raises ValueError when the limit is too
+    small to give every worker at least 1.
+    """
+    if not total:
+        return 0
+    if total < workers:
+        raise ValueError(f"limit {total} can't be split across {workers} workers")
+    return total // workers
+
+
+# Shared by every connection in this process; with several workers each gets
+# an equal share of the configured limits
+try:
+    scheduler = Scheduler(worker_share(MODEL_MAX_CONCURRENCY, WORKERS),
+                          worker_share(MODEL_TOKENS_PER_MINUTE, WORKERS))
+except ValueError as e:
+    raise SystemExit(f"PILOT_WORKERS={WORKERS} is too many for the model limits ({e}); "
+                     f"lower it or raise PILOT_MODEL_CONCURRENCY / PILOT_MODEL_TPM") from None
@@ -1,18 +1,45 @@
 """Pilot server - WebSocket for low-latency control."""
 import asyncio
+import base64
 import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from pathlib import Path
 
 import config
 import tmux
 import context
 import gemini
+import scheduler
+import audio
+import metrics
+import watcher
 from logging_config import logger
 
-app = FastAPI(title="Pilot")
+# Open websockets, for pushing watcher notifications
+clients: set[WebSocket] = set()
+
+
+async def broadcast(frame: dict):
+    """Send a frame to every connected client, skipping ones that went away."""
+    for ws in list(clients):
+        try:
+            await ws.send_json(frame)
+        except Exception:
+            clients.discard(ws)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Each worker watches for its own clients
+    task = asyncio.create_task(watcher.run(broadcast, lambda: bool(clients)))
+    yield
+    task.cancel()
+
+
+app = FastAPI(title="Pilot", lifespan=lifespan)
 
 STATIC_DIR = Path(__file__).parent / "static"
 if STATIC_DIR.exists():
@@ -36,6 +63,121 @@ async def get_token():
     return {"token": config.AUTH_TOKEN}
 
 
+def client_config() -> dict:
+    """Settings the browser needs so recording matches the server's limits."""
+    return {
+        "type": "config",
+        "audio_bitrate": config.AUDIO_BITRATE,
+        "audio_max_ms": int(config.AUDIO_MAX_SECONDS * 1000),
+    }
+
+
+metrics.gauge("pilot_model_active", lambda: scheduler.scheduler.active)
+metrics.gauge("pilot_model_queued", lambda: scheduler.scheduler.queued)
+metrics.gauge("pilot_model_dropped", lambda: scheduler.scheduler.dropped)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render())
+
+
+async def prepare_audio(data: dict) -> str:
+    """Trim/re-encode the voice clip in a cmd message, recording sizes."""
+    raw = base64.b64decode(data["audio"])
+    meta = data.get("audio_meta") or {}
+    clip = await audio.preprocess(raw, meta.get("start_ms"), meta.get("end_ms"),
+                                  meta.get("duration_ms"), meta.get("bitrate"))
+    metrics.observe("pilot_audio_upload_bytes", len(raw))
+    metrics.observe("pilot_audio_model_bytes", len(clip))
+    if meta.get("duration_ms"):
+        metrics.observe("pilot_audio_upload_seconds", meta["duration_ms"] / 1000)
+    logger.debug(f"Audio: {len(raw)} -> {len(clip)} bytes")
+    return base64.b64encode(clip).decode() if clip is not raw else data["audio"]
+
+
+async def handle_command(websocket: WebSocket, data: dict, is_stale,
+                         previous: asyncio.Future = None, finished: asyncio.Future = None):
+    """Run one cmd message: translate, display, execute, log.
+
+    Translation may overlap with other commands on the connection and a
+    request still queued when a newer one arrives is dropped unsent. Once a
+    reply is in hand it is executed, after the previous command's (previous)
+    has finished, so replies run in arrival order. finished is resolved
+    however this command ends.
+    """
+    try:
+        await _handle_command(websocket, data, is_stale, previous)
+    finally:
+        if finished and not finished.done():
+            finished.set_result(None)
+
+
+async def _handle_command(websocket: WebSocket, data: dict, is_stale, previous: asyncio.Future):
+    text = data.get("text", "(no text)")
+    logger.debug(f"Command: {text[:100]}")
+
+    # Get full tmux screen contents
+    # Off the event loop: captures block on subprocesses and the cross-worker lock
+    screens = await asyncio.to_thread(tmux.cached_screens, 100)
+    logger.debug(f"Tmux sessions: {list(screens.keys())}")
+
+    ctx = context.load()
+
+    # Translate with Gemini
+    logger.debug("Calling Gemini...")
+    try:
+        audio_b64 = await prepare_audio(data) if data.get("audio") else None
+        result = await gemini.translate(
+            text=data.get("text"),
+            audio_b64=audio_b64,
+            image_b64=data.get("image"),
+            screen=data.get("screen"),
+            tmux_screens=screens,
+            context=ctx,
+            gps=data.get("gps"),
+            priority=scheduler.INTERACTIVE,
+            is_stale=is_stale,
+        )
+    except scheduler.StaleRequest:
+        logger.debug(f"Dropped stale command: {text[:50]}")
+        return
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        await websocket.send_json({"type": "error", "message": str(e)})
+        return
+    logger.debug(f"Gemini result: commands={len(result.get('commands', []))}")
+
+    if previous:
+        await previous
+    try:
+        # Send display immediately
+        await websocket.send_json({
+            "type": "display",
+            "text": result.get("display", ""),
+        })
+
+        # Execute commands
+        commands = [cmd for cmd in result.get("commands", []) if cmd.get("keys")]
+        for cmd in commands:
+            logger.info(f"Exec: {cmd['keys'][:50]} -> {cmd.get('target') or 'default'}")
+        if commands:
+            await asyncio.to_thread(tmux.send_batch, commands)
+
+        # Update context
+        await asyncio.to_thread(
+            context.update,
+            task=result.get("task"),
+            note=result.get("note"),
+        )
+    except Exception as e:
+        logger.error(f"Error: {e}", exc_info=True)
+        try:
+            await websocket.send_json({"type": "error", "message": str(e)})
+        except Exception:
+            pass  # client is gone
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, token: str = Query(None)):
     client = websocket.client.host if websocket.client else "unknown"
@@ -47,6 +189,14 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None)):
 
     await websocket.accept()
     logger.info(f"Client connected: {client}")
+    clients.add(websocket)
+    await websocket.send_json(client_config())
+
+    # A queued command goes stale once a newer one arrives or the client leaves
+    latest = 0
+    connected = True
+    tasks = set()
+    last_finished = None  # chains execution in arrival order
 
     try:
         while True:
@@ -58,58 +208,35 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(None)):
                 continue
 
             if msg_type == "cmd":
-                text = data.get("text", "(no text)")
-                logger.debug(f"Command: {text[:100]}")
-
-                # Get full tmux screen contents
-                screens = tmux.get_all_screens(lines=100)
-                logger.debug(f"Tmux sessions: {list(screens.keys())}")
-
-                ctx = context.load()
-
-                # Translate with Gemini
-                logger.debug("Calling Gemini...")
-                result = await gemini.translate(
-                    text=data.get("text"),
-                    audio_b64=data.get("audio"),
-                    image_b64=data.get("image"),
-                    screen=data.get("screen"),
-                    tmux_screens=screens,
-                    context=ctx,
-                    gps=data.get("gps"),
-                )
-                logger.debug(f"Gemini result: commands={len(result.get('commands', []))}")
-
-                # Send display immediately
-                await websocket.send_json({
-                    "type": "display",
-                    "text": result.get("display", ""),
-                })
-
-                # Execute commands
-                for cmd in result.get("commands", []):
-                    target = cmd.get("target", "")
-                    keys = cmd.get("keys", "")
-                    if keys:
-                        session = target.split(":")[0] if target else None
-                        window = target.split(":")[1] if ":" in target else None
-                        logger.info(f"Exec: {keys[:50]} -> {target or 'default'}")
-                        tmux.send_keys(keys, session=session, window=window)
-
-                # Update context
-                context.update(
-                    task=result.get("task"),
-                    note=result.get("note"),
-                )
+                latest += 1
+                seq = latest
+                previous, last_finished = last_finished, asyncio.get_running_loop().create_future()
+                task = asyncio.create_task(handle_command(
+                    websocket, data,
+                    is_stale=lambda seq=seq: not connected or latest != seq,
+                    previous=previous,
+                    finished=last_finished,
+                ))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
 
     except WebSocketDisconnect:
         logger.info(f"Client disconnected: {client}")
     except Exception as e:
         logger.error(f"Error: {e}", exc_info=True)
         await websocket.send_json({"type": "error", "message": str(e)})
+    finally:
+        connected = False
+        clients.discard(websocket)
+        # Let in-flight commands finish; anything still queued is now stale
+        scheduler.scheduler.wake()
 
 
 if __name__ == "__main__":
     import uvicorn
-    logger.info(f"Pilot starting on {config.HOST}:{config.PORT}")
-    uvicorn.run(app, host=config.HOST, port=config.PORT, log_level="warning")
+    logger.info(f"Pilot starting on {config.HOST}:{config.PORT} ({config.WORKERS} workers)")
+    if config.WORKERS > 1:
+        # Workers share context, tmux ordering and captures through ~/.pilot/locks
+        uvicorn.run("server:app", host=config.HOST, port=config.PORT, workers=config.WORKERS, log_level="warning")
+    else:
+        uvicorn.run(app, host=config.HOST, port=config.PORT, log_level="warning")
@@ -0,0 +1,9 @@
+// Only here so Android Chrome can show watcher notifications
+// (ServiceWorkerRegistration.showNotification); no caching, no fetch handler
+self.addEventListener('notificationclick', event => {
+  event.notification.close();
+  event.waitUntil(
+    clients.matchAll({ type: 'window', includeUncontrolled: true })
+      .then(windows => windows.length ? windows[0].focus() : clients.openWindow('/'))
+  );
+});
@@ -22,6 +22,17 @@ class TestConfig:
         assert config.AUTH_TOKEN
         assert len(config.AUTH_TOKEN) > 20
 
+    def test_capture_cache_off_for_one_worker(self):
+        import os
+        import subprocess
+        import sys
+        env = {k: v for k, v in os.environ.items() if k != "PILOT_CAPTURE_CACHE_TTL"}
+        code = "import config; print(config.CAPTURE_CACHE_TTL)"
+        for workers, ttl in (("1", "0.0"), ("2", "1.0")):
+            out = subprocess.run([sys.executable, "-c", code], env={**env, "PILOT_WORKERS": workers},
+                                 cwd=Path(__file__).parent, capture_output=True, text=True, check=True)
+            assert out.stdout.strip() == ttl
+
     def test_load_user_instructions_no_file(self):
         """When prompt.md doesn't exist, returns None."""
         import config
@@ -82,6 +93,180 @@ class TestTmux:
         assert "-t main" in call_arg
         assert "ls -la" in call_arg
 
+    def test_parse_target(self):
+        import tmux
+        with patch.object(tmux, "HOSTS", ["devbox"]):
+            assert tmux.parse_target("devbox:main:1") == ("devbox", "main", "1")
+            assert tmux.parse_target("devbox:main") == ("devbox", "main", None)
+            assert tmux.parse_target("main:1") == (None, "main", "1")
+            assert tmux.parse_target("devbox") == (None, "devbox", None)
+            assert tmux.parse_target("") == (None, None, None)
+
+    @patch("tmux.ensure_master")
+    @patch("tmux.subprocess.run")
+    def test_run_remote_uses_control_socket(self, mock_sub, mock_master):
+        import tmux
+        mock_sub.return_value = MagicMock(stdout="ok", stderr="")
+        assert tmux.run("tmux ls", host="devbox") == "ok"
+        mock_master.assert_called_once_with("devbox")
+        cmd = mock_sub.call_args[0][0]
+        assert cmd.startswith("ssh ")
+        assert "ControlMaster=no" in cmd
+        assert str(tmux.control_path("devbox")) in cmd
+        assert cmd.endswith("devbox 'tmux ls'")
+
+    def test_ensure_master_starts_one_per_host(self):
+        import threading
+        import time
+        import tmux
+        with tempfile.TemporaryDirectory() as d, patch.object(tmux, "SSH_CONTROL_DIR", Path(d)):
+            def start(host, path):
+                time.sleep(0.05)
+                path.touch()  # the master's socket appears
+
+            with patch.object(tmux, "_start_master", side_effect=start) as spawn:
+                threads = [threading.Thread(target=tmux.ensure_master, args=("devbox",)) for _ in range(4)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+            assert spawn.call_count == 1
+
+    @patch("tmux.run")
+    def test_capture_host_splits_sessions(self, mock_run):
+        import tmux
+        sep = tmux.RECORD_SEP
+        mock_run.return_value = f"{sep}main\n$ make\nok\n{sep}idle\n\n{sep}work\n$ \n"
+        screens = tmux.capture_host("devbox")
+        assert screens == {"main": "$ make\nok\n", "work": "$ \n"}
+        assert mock_run.call_args.kwargs["host"] == "devbox"
+
+    @patch("tmux.run")
+    def test_capture_host_unreachable(self, mock_run):
+        import tmux
+        mock_run.return_value = "ssh: connect to host devbox port 22: Connection refused"
+        assert tmux.capture_host("devbox") == {}
+
+    def test_unreachable_host_backs_off(self):
+        import subprocess
+        import tmux
+        down = subprocess.CompletedProcess("ssh", 255, "", "ssh: connect to host devbox port 22: timed out")
+        with patch.object(tmux, "_host_down", {}), \
+                patch.object(tmux, "ensure_master"), \
+                patch.object(tmux.subprocess, "run", return_value=down) as mock_sub:
+            assert tmux.capture_host("devbox") == {}
+            assert tmux.capture_host("devbox") == {}  # skipped, no second ssh
+            assert mock_sub.call_count == 1
+            with patch.object(tmux.time, "monotonic", return_value=tmux._host_down["devbox"]):
+                mock_sub.return_value = subprocess.CompletedProcess("ssh", 0, f"{tmux.RECORD_SEP}main\n$ \n", "")
+                assert tmux.capture_host("devbox") == {"main": "$ \n"}  # retried after backoff
+            assert not tmux.host_down("devbox")
+
+    def test_get_all_screens_multi_host(self):
+        import tmux
+        with patch.object(tmux, "HOSTS", ["a", "b"]), \
+                patch.object(tmux, "capture_local", return_value={"main": "local"}), \
+                patch.object(tmux, "capture_host", side_effect=lambda h, n: {"main": f"on {h}"}):
+            screens = tmux.get_all_screens()
+            assert screens == {"main": "local", "a:main": "on a", "b:main": "on b"}
+            assert tmux.group_by_host(screens) == {
+                "": {"main": "local"},
+                "a": {"main": "on a"},
+                "b": {"main": "on b"},
+            }
+
+    @pytest.mark.skipif(not os.getenv("PILOT_TEST_SSH_HOST"), reason="set PILOT_TEST_SSH_HOST to a reachable sshd")
+    def test_remote_roundtrip(self):
+        """End to end against a real sshd (e.g. PILOT_TEST_SSH_HOST=localhost)."""
+        import tmux
+        host = os.environ["PILOT_TEST_SSH_HOST"]
+        with patch.object(tmux, "HOSTS", [host]):
+            tmux.new_session("pilot-ssh-test", "cat", host=host)
+            try:
+                tmux.send_keys("hello-remote", session="pilot-ssh-test", host=host)
+                screens = tmux.capture_host(host)
+                assert "hello-remote" in screens["pilot-ssh-test"]
+                assert tmux.control_path(host).exists()  # master stayed up
+            finally:
+                tmux.run("tmux kill-session -t pilot-ssh-test", host=host)
+
+
+class TestPaneBuffer:
+    """Test pipe-pane ring buffers."""
+
+    def test_strip_ansi_split_across_chunks(self):
+        import panebuf
+        stripper = panebuf.AnsiStripper()
+        out = stripper.feed(b"\x1b[31mred\x1b[") + stripper.feed(b"0m done\r\n\x1b]0;title\x07$ ")
+        assert out == b"red done\n$ "
+
+    def test_strip_split_osc_and_carriage_returns(self):
+        import panebuf
+        stripper = panebuf.AnsiStripper()
+        assert stripper.feed(b"ok\x1b]0;my-title") + stripper.feed(b"\x07$ ") == b"ok$ "
+        assert stripper.feed(b"a\x1b]0;t\x1b") + stripper.feed(b"\\b") == b"ab"
+        out = stripper.feed(b"10%\r20%\r") + stripper.feed(b"30%\r") + stripper.feed(b"\ndone")
+        assert out == b"10%\n20%\n30%\ndone"
+
+    def test_tail_lines(self):
+        import panebuf
+        with tempfile.TemporaryDirectory() as d:
+            ring = panebuf.RingBuffer.create(Path(d) / "p.ring", capacity=4096)
+            ring.append(b"one\ntwo\nthree\n$ ")
+            assert ring.tail(2) == "three\n$ "
+            ring.append(b"ls\n")
+            assert ring.tail(2) == "three\n$ ls\n"
+            assert ring.tail(100) == "one\ntwo\nthree\n$ ls\n"
+            ring.close()
+
+    def test_wraps_and_drops_cut_line(self):
+        import panebuf
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "p.ring"
+            ring = panebuf.RingBuffer.create(path, capacity=64, slots=8)
+            for i in range(100):
+                ring.append(f"line {i}\n".encode())
+            reader = panebuf.RingBuffer(path)
+            assert reader.tail(3) == "line 97\nline 98\nline 99\n"
+            # More lines than the ring holds: whole lines only, newest last
+            everything = reader.tail(1000).splitlines()
+            assert everything[-1] == "line 99"
+            assert all(l.startswith("line ") for l in everything)
+            assert len("\n".join(everything)) < 64
+            reader.close()
+            ring.close()
+
+    def test_rejects_other_files(self):
+        import panebuf
+        with tempfile.NamedTemporaryFile(suffix=".ring") as f:
+            f.write(b"x" * 128)
+            f.flush()
+            with pytest.raises(ValueError):
+                panebuf.RingBuffer(f.name)
+
+    @patch("tmux.run")
+    def test_attach_buffers_pipes_new_panes(self, mock_run):
+        import tmux
+        with tempfile.TemporaryDirectory() as d, patch.object(tmux, "PANE_BUFFER_DIR", Path(d)):
+            (Path(d) / "9.ring").write_bytes(b"")  # pane that went away
+            mock_run.return_value = "%1 011 main\n%2 111 work\n%3 000 work\n"
+            active = tmux.attach_buffers()
+            assert active == {"main": "%1", "work": "%2"}
+            pipes = [c[0][0] for c in mock_run.call_args_list if "pipe-pane" in c[0][0]]
+            assert len(pipes) == 2  # %1 and %3; %2 already piped
+            assert "-t %1" in pipes[0] and "1.ring" in pipes[0]
+            assert not (Path(d) / "9.ring").exists()
+
+    @patch("tmux.run")
+    def test_attach_buffers_keeps_rings_when_listing_fails(self, mock_run):
+        import tmux
+        with tempfile.TemporaryDirectory() as d, patch.object(tmux, "PANE_BUFFER_DIR", Path(d)):
+            (Path(d) / "1.ring").write_bytes(b"")
+            for failure in ("[timeout]", "", "no server running on /tmp/tmux-0/default\n"):
+                mock_run.return_value = failure
+                assert tmux.attach_buffers() == {}
+                assert (Path(d) / "1.ring").exists()
+
 
 class TestContext:
     """Test context module."""
@@ -128,6 +313,162 @@ class TestContext:
         finally:
             temp_path.unlink()
 
+    def test_concurrent_updates_from_processes(self):
+        """Workers updating at once must not lose each other's log entries."""
+        import multiprocessing
+        import context
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "context.md"
+            with patch.object(context, "CONTEXT_FILE", path):
+                def worker(n):
+                    for i in range(4):
+                        context.update(note=f"worker{n}-{i}")
+                ctx = multiprocessing.get_context("fork")
+                procs = [ctx.Process(target=worker, args=(n,)) for n in range(3)]
+                for p in procs:
+                    p.start()
+                for p in procs:
+                    p.join()
+                result = context.load()
+            for n in range(3):
+                for i in range(4):
+                    assert f"worker{n}-{i}" in result
+
+
+class TestLocks:
+    """Test cross-worker coordination."""
+
+    def test_atomic_write(self):
+        import locks
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "f.txt"
+            locks.atomic_write(path, "one")
+            locks.atomic_write(path, "two")
+            assert path.read_text() == "two"
+            assert [p.name for p in Path(d).iterdir()] == ["f.txt"]
+
+    def test_file_lock_excludes_threads(self):
+        import threading
+        import time
+        import locks
+        inside = []
+        overlap = []
+
+        def hold():
+            with locks.file_lock("pilot-test"):
+                inside.append(1)
+                overlap.append(len(inside))
+                time.sleep(0.01)
+                inside.pop()
+
+        threads = [threading.Thread(target=hold) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert max(overlap) == 1
+
+    def test_fifo_lock_grants_in_request_order(self):
+        import threading
+        import time
+        import locks
+        order = []
+
+        def wait(i):
+            with locks.fifo_lock("pilot-test-fifo"):
+                order.append(i)
+
+        with locks.fifo_lock("pilot-test-fifo"):
+            threads = []
+            for i in range(4):
+                threads.append(threading.Thread(target=wait, args=(i,)))
+                threads[-1].start()
+                time.sleep(0.05)  # queue each waiter before the next
+        for t in threads:
+            t.join()
+        assert order == [0, 1, 2, 3]
+
+    def test_fifo_lock_polling_does_not_write(self):
+        import threading
+        import time
+        import locks
+        writes = []
+        real_write = locks.atomic_write
+
+        def counting_write(path, text, mode=0o666):
+            writes.append(text)
+            real_write(path, text, mode)
+
+        def wait():
+            with locks.fifo_lock("pilot-test-poll"):
+                pass
+
+        with patch.object(locks, "atomic_write", counting_write):
+            with locks.fifo_lock("pilot-test-poll"):
+                waiter = threading.Thread(target=wait)
+                waiter.start()
+                time.sleep(0.2)  # the waiter polls ~20 times meanwhile
+            waiter.join()
+        assert len(writes) == 4  # two enqueues, two dequeues
+
+    def test_send_batch_not_interleaved(self):
+        import threading
+        import time
+        import tmux
+        sent = []
+
+        def slow_run(cmd, host=None):
+            sent.append(cmd.split("'")[1])
+            time.sleep(0.01)
+            return ""
+
+        with patch.object(tmux, "run", slow_run), patch.object(tmux, "invalidate_cache"):
+            threads = [
+                threading.Thread(target=tmux.send_batch, args=([
+                    {"target": "main:0", "keys": f"{n}1"},
+                    {"target": "main:1", "keys": f"{n}2"},
+                ],))
+                for n in "ab"
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        assert sent in (["a1", "a2", "b1", "b2"], ["b1", "b2", "a1", "a2"])
+
+    def test_cached_screens_shared(self):
+        import tmux
+        with tempfile.TemporaryDirectory() as d, \
+                patch.object(tmux, "CAPTURE_CACHE_FILE", Path(d) / "screens.json"), \
+                patch.object(tmux, "CAPTURE_CACHE_GEN_FILE", Path(d) / "screens.gen"), \
+                patch.object(tmux, "CAPTURE_CACHE_TTL", 60), \
+                patch.object(tmux, "get_all_screens", return_value={"main": "$ "}) as capture:
+            assert tmux.cached_screens(100) == {"main": "$ "}
+            assert (Path(d) / "screens.json").stat().st_mode & 0o777 == 0o600
+            assert tmux.cached_screens(100) == {"main": "$ "}
+            assert capture.call_count == 1
+            tmux.cached_screens(50)  # different depth is a miss
+            assert capture.call_count == 2
+            with patch.object(tmux, "run", return_value=""):
+                tmux.send_keys("ls", session="main")
+            tmux.cached_screens(50)  # input invalidates
+            assert capture.call_count == 3
+
+    def test_cached_screens_not_written_after_invalidation(self):
+        import tmux
+
+        def capture(lines):
+            tmux.invalidate_cache()  # keys sent while we were capturing
+            return {"main": "old"}
+
+        with tempfile.TemporaryDirectory() as d, \
+                patch.object(tmux, "CAPTURE_CACHE_FILE", Path(d) / "screens.json"), \
+                patch.object(tmux, "CAPTURE_CACHE_GEN_FILE", Path(d) / "screens.gen"), \
+                patch.object(tmux, "CAPTURE_CACHE_TTL", 60), \
+                patch.object(tmux, "get_all_screens", capture):
+            assert tmux.cached_screens(100) == {"main": "old"}
+            assert not (Path(d) / "screens.json").exists()
+
 
 class TestGemini:
     """Test gemini module."""
@@ -281,6 +622,311 @@ class TestGemini:
             assert result["commands"] == []
             assert "note" in result
 
+    @pytest.mark.asyncio
+    async def test_translate_groups_hosts(self):
+        """Remote sessions are shown under a per-host heading."""
+        import gemini
+        mock_response = MagicMock()
+        mock_response.text = json.dumps({"commands": [], "display": "ok"})
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock(return_value=mock_response)
+
+        with patch.object(gemini, "client", mock_client), patch("tmux.HOSTS", ["devbox"]):
+            await gemini.translate(text="status", tmux_screens={"main": "local", "devbox:main": "remote"})
+            contents = mock_client.aio.models.generate_content.call_args.kwargs["contents"]
+            prompt = contents[0].parts[0].text
+            assert "=== HOST local ===" in prompt
+            assert "=== HOST devbox ===" in prompt
+            assert "[devbox:main]\nremote" in prompt
+
+    @pytest.mark.asyncio
+    async def test_translate_stale_skips_model(self):
+        """A request that went stale while queued never reaches the model."""
+        import gemini
+        import scheduler
+        mock_client = MagicMock()
+        mock_client.aio.models.generate_content = AsyncMock()
+
+        with patch.object(gemini, "client", mock_client):
+            with pytest.raises(scheduler.StaleRequest):
+                await gemini.translate(text="status", is_stale=lambda: True)
+            mock_client.aio.models.generate_content.assert_not_called()
+
+
+class TestScheduler:
+    """Test model admission control."""
+
+    @pytest.mark.asyncio
+    async def test_concurrency_bounded(self):
+        import asyncio
+        import scheduler
+        sched = scheduler.Scheduler(max_concurrency=2)
+        running = []
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            async with sched.slot():
+                running.append(1)
+                peak = max(peak, len(running))
+                await asyncio.sleep(0.01)
+                running.pop()
+
+        await asyncio.gather(*[job() for _ in range(6)])
+        assert peak == 2
+        assert sched.active == 0
+
+    @pytest.mark.asyncio
+    async def test_interactive_before_background(self):
+        import asyncio
+        import scheduler
+        sched = scheduler.Scheduler(max_concurrency=1)
+        order = []
+
+        async def job(name, priority):
+            async with sched.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        await sched.acquire()  # hold the only slot while others queue
+        tasks = [
+            asyncio.create_task(job("bg", scheduler.BACKGROUND)),
+            asyncio.create_task(job("voice", scheduler.INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        sched.release()
+        await asyncio.gather(*tasks)
+        assert order == ["voice", "bg"]
+
+    @pytest.mark.asyncio
+    async def test_stale_request_dropped(self):
+        import asyncio
+        import scheduler
+        sched = scheduler.Scheduler(max_concurrency=1)
+        stale = False
+
+        await sched.acquire()
+        task = asyncio.create_task(sched.acquire(is_stale=lambda: stale))
+        await asyncio.sleep(0)
+        stale = True
+        sched.release()
+        with pytest.raises(scheduler.StaleRequest):
+            await task
+        assert sched.dropped == 1
+        assert sched.active == 0
+
+    @pytest.mark.asyncio
+    async def test_token_budget_delays(self):
+        import asyncio
+        import scheduler
+        sched = scheduler.Scheduler(max_concurrency=4, tokens_per_minute=6000)  # 100/s
+        await sched.acquire(cost=6000)
+        sched.release()
+        task = asyncio.create_task(sched.acquire(cost=5))
+        await asyncio.sleep(0)
+        assert not task.done()  # bucket empty, ~50ms until refilled
+        await asyncio.wait_for(task, timeout=1)
+        sched.release()
+
+    def test_estimate_tokens(self):
+        import scheduler
+        assert scheduler.estimate_tokens("x" * 400) == 100
+        assert scheduler.estimate_tokens("", audio_bytes=4000) == 32
+        assert scheduler.estimate_tokens("", image=True, max_output=10) == 268
+
+    def test_worker_share_never_exceeds_limit(self):
+        import scheduler
+        for total in (4, 5, 7):
+            for workers in range(1, total + 1):
+                assert 1 <= scheduler.worker_share(total, workers) * workers <= total
+        assert scheduler.worker_share(0, 3) == 0  # unlimited stays unlimited
+        with pytest.raises(ValueError):
+            scheduler.worker_share(2, 3)
+
+
+class TestWatcher:
+    """Test background pane watchers."""
+
+    def test_regex_fires_on_new_match_only(self):
+        import watcher
+        w = watcher.Watcher([watcher.Rule(name="tests", type="regex", pattern=r"\d+ passed", cooldown=0)])
+        assert w.check({"main": "$ pytest\n3 passed"}, now=0) == []  # already there
+        assert w.check({"main": "$ pytest\n3 passed\n$ pytest"}, now=1) == []
+        events = w.check({"main": "$ pytest\n3 passed\n$ pytest\n5 passed"}, now=2)
+        assert [e["detail"] for e in events] == ["5 passed"]
+
+    def test_regex_repeat_and_screen_order(self):
+        import watcher
+        w = watcher.Watcher([watcher.Rule(name="tests", type="regex", pattern=r"\d+ passed", cooldown=0)])
+        w.check({"main": "$ pytest\n3 passed"}, now=0)
+        events = w.check({"main": "$ pytest\n3 passed\n$ pytest\n3 passed"}, now=1)
+        assert [e["detail"] for e in events] == ["3 passed"]  # same text, new run
+        events = w.check({"main": "$ pytest\n3 passed\n$ pytest\n3 passed\n9 passed\n10 passed"}, now=2)
+        assert [e["detail"] for e in events] == ["10 passed"]  # last on screen, not last sorted
+
+    def test_idle_after_busy(self):
+        import watcher
+        w = watcher.Watcher([watcher.Rule(name="idle", type="idle", idle_seconds=10)])
+        assert w.check({"main": "a"}, now=0) == []
+        assert w.check({"main": "a"}, now=20) == []  # never busy
+        assert w.check({"main": "ab"}, now=21) == []
+        assert w.check({"main": "ab"}, now=25) == []
+        assert len(w.check({"main": "ab"}, now=31)) == 1
+        assert w.check({"main": "ab"}, now=60) == []  # once per quiet spell
+
+    def test_prompt_return(self):
+        import watcher
+        w = watcher.Watcher([watcher.Rule(name="done", type="prompt", cooldown=0)])
+        assert w.check({"main": "dev@box:~$ "}, now=0) == []
+        assert w.check({"main": "dev@box:~$ make\nbuilding..."}, now=1) == []
+        events = w.check({"main": "dev@box:~$ make\nbuilding...\ndev@box:~$ "}, now=2)
+        assert events[0]["detail"] == "back at the prompt"
+
+    def test_default_prompt_ignores_progress(self):
+        import re
+        import watcher
+        rx = re.compile(watcher.DEFAULT_PROMPT)
+        for line in ["dev@box:~/app$ ", "$ ", "❯ ", "root@box:/# ", "[dev@box app]$ ", "(venv) ~/app $", ">>> "]:
+            assert rx.search(line), line
+        for line in ["Downloading 45%", "progress: 100%", "building..."]:
+            assert not rx.search(line), line
+
+    def test_cooldown_and_session_glob(self):
+        import watcher
+        rule = watcher.Rule(name="err", type="regex", pattern="ERROR", session="agent-*", cooldown=30)
+        w = watcher.Watcher([rule])
+        w.check({"agent-1": "", "main": ""}, now=0)
+        events = w.check({"agent-1": "ERROR a", "main": "ERROR a"}, now=1)
+        assert [e["session"] for e in events] == ["agent-1"]
+        assert w.check({"agent-1": "ERROR a\nERROR b"}, now=5) == []
+
+    def test_load_rules(self):
+        import watcher
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "watch.toml"
+            path.write_text('[[rule]]\nname = "t"\ntype = "regex"\npattern = \'\\d+ failed\'\nsummarize = true\n')
+            with patch.object(watcher, "WATCH_FILE", path):
+                rules = watcher.load_rules()
+                assert rules[0].pattern == r"\d+ failed"
+                assert rules[0].summarize is True
+                path.write_text('[[rule]]\nname = "t"\ntype = "regex"\n')
+                with pytest.raises(ValueError):
+                    watcher.load_rules()
+
+    @pytest.mark.asyncio
+    async def test_summary_uses_background_priority(self):
+        import watcher
+        import scheduler
+        rule = watcher.Rule(name="t", type="prompt", summarize=True)
+        w = watcher.Watcher([rule])
+        w.check({"main": "$ "}, now=0)
+        with patch.object(watcher.gemini, "translate", AsyncMock(return_value={"display": "build ok"})) as translate:
+            frame = await watcher.notify_frame({"rule": rule, "session": "main", "detail": "x"}, w)
+        assert frame == {"type": "notify", "rule": "t", "session": "main", "text": "main: x", "summary": "build ok"}
+        assert translate.call_args.kwargs["priority"] == scheduler.BACKGROUND
+
+    @pytest.mark.asyncio
+    async def test_failed_summary_not_attached(self):
+        import watcher
+        rule = watcher.Rule(name="t", type="prompt", summarize=True)
+        failed = {"commands": [], "display": "Error: GEMINI_API_KEY not set", "note": "missing API key"}
+        with patch.object(watcher.gemini, "translate", AsyncMock(return_value=failed)):
+            frame = await watcher.notify_frame({"rule": rule, "session": "main", "detail": "x"}, watcher.Watcher([rule]))
+        assert "summary" not in frame
+
+    @pytest.mark.asyncio
+    async def test_slow_summary_does_not_block_polling(self):
+        import asyncio
+        import watcher
+        rule = watcher.Rule(name="t", type="regex", pattern="done", summarize=True, cooldown=0)
+        polls, frames = [], []
+        release = asyncio.Event()
+
+        def capture(lines):
+            polls.append(1)
+            return {"main": "done\n" * len(polls)}
+
+        async def slow_translate(**kwargs):
+            await release.wait()
+            return {"display": "ok"}
+
+        async def broadcast(frame):
+            frames.append(frame)
+
+        with tempfile.NamedTemporaryFile(suffix=".toml") as f, \
+                patch.object(watcher, "WATCH_FILE", Path(f.name)), \
+                patch.object(watcher, "load_rules", return_value=[rule]), \
+                patch.object(watcher, "WATCH_INTERVAL", 0.01), \
+                patch.object(watcher.tmux, "cached_screens", capture), \
+                patch.object(watcher.gemini, "translate", slow_translate):
+            task = asyncio.create_task(watcher.run(broadcast, lambda: True))
+            await asyncio.sleep(0.2)
+            assert len(polls) > 3 and frames == []  # kept polling while summaries wait
+            release.set()
+            await asyncio.sleep(0.05)
+            task.cancel()
+        assert frames and frames[0]["summary"] == "ok"
+
+
+class TestAudio:
+    """Test voice clip preprocessing."""
+
+    def test_ffmpeg_args_uses_client_span(self):
+        import audio
+        args = audio.ffmpeg_args(start_ms=1200, end_ms=3400)
+        assert args[args.index("-ss") + 1] == "1.000"
+        assert args[args.index("-t") + 1] == "2.600"
+        assert "-to" not in args  # ffmpeg would let -t override it
+        assert "-af" not in args
+        assert args[args.index("-b:a") + 1] == str(audio.AUDIO_BITRATE)
+
+    def test_ffmpeg_args_detects_silence(self):
+        import audio
+        args = audio.ffmpeg_args()
+        assert "-ss" not in args
+        assert "silenceremove" in args[args.index("-af") + 1]
+        assert args[args.index("-t") + 1] == f"{audio.AUDIO_MAX_SECONDS:.3f}"
+
+    def test_ffmpeg_args_caps_long_span(self):
+        import audio
+        args = audio.ffmpeg_args(start_ms=0, end_ms=120_000)
+        assert "-ss" not in args
+        assert args[args.index("-t") + 1] == f"{audio.AUDIO_MAX_SECONDS:.3f}"
+
+    @pytest.mark.asyncio
+    async def test_preprocess_skips_trimmed_client_clip(self):
+        import audio
+        with patch.object(audio, "FFMPEG", "/usr/bin/ffmpeg"), \
+                patch.object(audio.asyncio, "create_subprocess_exec") as spawn:
+            clip = await audio.preprocess(b"webm", start_ms=150, end_ms=2400, duration_ms=3900, bitrate=audio.AUDIO_BITRATE)
+            assert clip == b"webm"
+            spawn.assert_not_called()
+        assert not audio.client_clip_ok(150, 2400, 3900, bitrate=audio.AUDIO_BITRATE * 2)
+        assert not audio.client_clip_ok(5000, 6000, 9000, bitrate=audio.AUDIO_BITRATE)  # mostly silence
+        assert not audio.client_clip_ok(150, 2400, 3900, bitrate=None)  # unknown, re-encode
+
+    @pytest.mark.asyncio
+    async def test_preprocess_without_ffmpeg_passes_through(self):
+        import audio
+        with patch.object(audio, "FFMPEG", None):
+            assert await audio.preprocess(b"webm-bytes") == b"webm-bytes"
+
+
+class TestMetrics:
+    """Test metrics module."""
+
+    def test_render(self):
+        import metrics
+        metrics.reset()
+        metrics.inc("pilot_test_total")
+        metrics.observe("pilot_test_bytes", 100)
+        metrics.observe("pilot_test_bytes", 300)
+        text = metrics.render()
+        assert "pilot_test_total 1" in text
+        assert "pilot_test_bytes_count 2" in text
+        assert "pilot_test_bytes_sum 400" in text
+        assert "pilot_test_bytes_max 300" in text
+
 
 class TestServer:
     """Test server endpoints."""
@@ -293,6 +939,94 @@ class TestServer:
         assert response.status_code == 200
         assert "html" in response.headers.get("content-type", "").lower()
 
+    def test_metrics_endpoint(self):
+        from fastapi.testclient import TestClient
+        import server
+        client = TestClient(server.app)
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert "pilot_model_active" in response.text
+
+    def test_websocket_sends_audio_limits(self):
+        from fastapi.testclient import TestClient
+        import server
+        client = TestClient(server.app)
+        with patch.object(server.config, "AUDIO_BITRATE", 16000), \
+                patch.object(server.config, "AUDIO_MAX_SECONDS", 12.5), \
+                client.websocket_connect(f"/ws?token={server.config.AUTH_TOKEN}") as ws:
+            assert ws.receive_json() == {"type": "config", "audio_bitrate": 16000, "audio_max_ms": 12500}
+
+    @pytest.mark.asyncio
+    async def test_prepare_audio_records_sizes(self):
+        import base64
+        import server
+        import metrics
+        metrics.reset()
+        data = {"audio": base64.b64encode(b"x" * 1000).decode(), "audio_meta": {"duration_ms": 2500}}
+        with patch.object(server.audio, "preprocess", AsyncMock(return_value=b"y" * 400)):
+            out = await server.prepare_audio(data)
+        assert base64.b64decode(out) == b"y" * 400
+        text = metrics.render()
+        assert "pilot_audio_upload_bytes_sum 1000" in text
+        assert "pilot_audio_model_bytes_sum 400" in text
+
+    @pytest.mark.asyncio
+    async def test_answered_commands_execute_in_arrival_order(self):
+        """A reply that comes back after a newer command's still runs, first."""
+        import asyncio
+        import server
+        replies = {"run tests": asyncio.Event(), "status": asyncio.Event()}
+        sent = []
+
+        async def translate(**kwargs):
+            await replies[kwargs["text"]].wait()
+            return {"commands": [{"target": "main", "keys": kwargs["text"]}], "display": kwargs["text"]}
+
+        ws = MagicMock()
+        ws.send_json = AsyncMock()
+        first, second = asyncio.get_running_loop().create_future(), asyncio.get_running_loop().create_future()
+        with patch.object(server.tmux, "cached_screens", return_value={}), \
+                patch.object(server.gemini, "translate", translate), \
+                patch.object(server.tmux, "send_batch", lambda cmds: sent.append(cmds[0]["keys"])), \
+                patch.object(server.context, "update"):
+            older = asyncio.create_task(server.handle_command(
+                ws, {"text": "run tests"}, lambda: True, finished=first))
+            newer = asyncio.create_task(server.handle_command(
+                ws, {"text": "status"}, lambda: False, previous=first, finished=second))
+            replies["status"].set()
+            await asyncio.sleep(0.05)
+            assert sent == []  # waits for the older reply
+            replies["run tests"].set()
+            await asyncio.gather(older, newer)
+        assert sent == ["run tests", "status"]
+        assert second.done()
+
+    @pytest.mark.asyncio
+    async def test_execute_error_reported(self):
+        import asyncio
+        import server
+        ws = MagicMock()
+        ws.send_json = AsyncMock()
+        finished = asyncio.get_running_loop().create_future()
+        with patch.object(server.tmux, "cached_screens", return_value={}), \
+                patch.object(server.gemini, "translate",
+                             AsyncMock(return_value={"commands": [{"keys": "ls"}], "display": "ok"})), \
+                patch.object(server.tmux, "send_batch", side_effect=RuntimeError("tmux gone")):
+            await server.handle_command(ws, {"text": "ls"}, lambda: False, finished=finished)
+        ws.send_json.assert_called_with({"type": "error", "message": "tmux gone"})
+        assert finished.done()
+
+    @pytest.mark.asyncio
+    async def test_broadcast_drops_dead_clients(self):
+        import server
+        alive, dead = MagicMock(), MagicMock()
+        alive.send_json = AsyncMock()
+        dead.send_json = AsyncMock(side_effect=RuntimeError("closed"))
+        with patch.object(server, "clients", {alive, dead}):
+            await server.broadcast({"type": "notify", "text": "done"})
+            assert server.clients == {alive}
+        alive.send_json.assert_awaited_once_with({"type": "notify", "text": "done"})
+
     def test_verify_token(self):
         import server
         import config
@@ -1,32 +1,237 @@
 """tmux session control with full screen capture."""
+import json
+import logging
+import os
+import shlex
 import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+import panebuf
+from locks import file_lock, fifo_lock, atomic_write
+from config import HOSTS, HOST_BACKOFF, SSH_CONTROL_DIR, SSH_CONTROL_PERSIST, CAPTURE_CACHE_FILE, CAPTURE_CACHE_TTL
+from config import CAPTURE_CACHE_GEN_FILE
+from config import PANE_BUFFERS, PANE_BUFFER_DIR, PANE_BUFFER_BYTES
 
-def run(cmd: str) -> str:
-    """Run shell command, return output."""
+logger = logging.getLogger("pilot.tmux")
+
+# Marks the start of each session in a batched remote capture
+RECORD_SEP = "\x1e"
+
+PANEBUF_SCRIPT = Path(__file__).parent / "panebuf.py"
+
+# Open ring buffer readers by pane id
+_buffers: dict[str, panebuf.RingBuffer] = {}
+
+
+def control_path(host: str) -> Path:
+    """Socket of the persistent ssh master for a host."""
+    safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in host)
+    return SSH_CONTROL_DIR / f"{safe}.sock"
+
+
+# host -> time.monotonic() until which captures skip it
+_host_down: dict[str, float] = {}
+
+
+def mark_host(host: str, ok: bool):
+    """Record whether the last ssh to host got through."""
+    if ok:
+        _host_down.pop(host, None)
+    elif host not in _host_down:
+        logger.warning(f"{host} unreachable, skipping it in captures for {HOST_BACKOFF:.0f}s")
+        _host_down[host] = time.monotonic() + HOST_BACKOFF
+
+
+def host_down(host: str) -> bool:
+    """True while host is backing off after a failed connection."""
+    until = _host_down.get(host)
+    if until is None:
+        return False
+    if time.monotonic() >= until:
+        _host_down.pop(host, None)  # let the next call try again
+        return False
+    return True
+
+
+def ensure_master(host: str):
+    """Start a background ssh master for host unless one is already up.
+
+    Serialized per host across threads and workers: two concurrent starts
+    would leave the loser running forever as a plain, unshared connection.
+    (ControlMaster=auto would be atomic, but the backgrounded master keeps
+    the caller's stderr pipe open and run() would hang on it.)
+    """
+    path = control_path(host)
+    if path.exists():
+        return
+    with file_lock(f"ssh-{path.stem}"):
+        if not path.exists():
+            _start_master(host, path)
+
+
+def _start_master(host: str, path: Path):
+    try:
+        # -f backgrounds after auth; stdio must not be our pipes or run() would
+        # wait on the master until it exits
+        result = subprocess.run(
+            ["ssh", "-MNf", "-o", f"ControlPath={path}", "-o", f"ControlPersist={SSH_CONTROL_PERSIST}",
+             "-o", "BatchMode=yes", "-o", "ConnectTimeout=5", host],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10,
+        )
+        if result.returncode != 0:
+            mark_host(host, False)
+    except Exception as e:
+        logger.warning(f"ssh master to {host} failed: {e}")
+        mark_host(host, False)
+
+
+def ssh_command(host: str, cmd: str) -> str:
+    """Wrap a shell command to run on host over its multiplexed connection."""
+    path = control_path(host)
+    return (f"ssh -o ControlMaster=no -o ControlPath={shlex.quote(str(path))} "
+            f"-o BatchMode=yes -o ConnectTimeout=5 {shlex.quote(host)} {shlex.quote(cmd)}")
+
+
+def run(cmd: str, host: str = None) -> str:
+    """Run shell command, locally or on a remote host, return output."""
+    timeout = 5
+    if host:
+        ensure_master(host)
+        cmd = ssh_command(host, cmd)
+        timeout = 10
     try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
+        if host:
+            if "Control socket connect" in result.stderr:
+                # Master died; drop the stale socket so the next call restarts it
+                control_path(host).unlink(missing_ok=True)
+            mark_host(host, result.returncode != 255)  # 255 = ssh itself failed
         return result.stdout + result.stderr
     except subprocess.TimeoutExpired:
+        if host:
+            mark_host(host, False)
         return "[timeout]"
     except Exception as e:
         return f"[error: {e}]"
 
 
-def list_sessions() -> list[str]:
+def parse_target(target: str) -> tuple[str, str, str]:
+    """Split 'host:session:window' / 'session:window' into (host, session, window).
+
+    The first part is only a host if it is one of the configured HOSTS.
+    Missing parts come back as None.
+    """
+    parts = target.split(":") if target else []
+    host = parts.pop(0) if len(parts) > 1 and parts[0] in HOSTS else None
+    session = parts[0] if parts and parts[0] else None
+    window = parts[1] if len(parts) > 1 and parts[1] else None
+    return host, session, window
+
+
+def list_sessions(host: str = None) -> list[str]:
     """List tmux session names."""
-    out = run("tmux list-sessions -F '#{session_name}' 2>/dev/null")
+    out = run("tmux list-sessions -F '#{session_name}' 2>/dev/null", host=host)
     if not out.strip() or "no server" in out:
         return []
     return [s.strip() for s in out.strip().split('\n') if s.strip()]
 
 
-def capture_screen(session: str, lines: int = 100) -> str:
+def capture_screen(session: str, lines: int = 100, host: str = None) -> str:
     """Capture full screen content from a session's active pane."""
-    return run(f"tmux capture-pane -t {session} -p -S -{lines} 2>/dev/null")
+    return run(f"tmux capture-pane -t {session} -p -S -{lines} 2>/dev/null", host=host)
 
 
-def get_all_screens(lines: int = 100) -> dict[str, str]:
-    """Get screen content from all tmux sessions."""
+def capture_host(host: str, lines: int = 100) -> dict[str, str]:
+    """Capture every session on a remote host in a single ssh round-trip.
+
+    A host that failed recently is skipped until its backoff runs out, so
+    one dead box doesn't add a connect timeout to every capture.
+    """
+    if host_down(host):
+        return {}
+    script = (
+        "tmux list-sessions -F '#{session_name}' 2>/dev/null | while IFS= read -r s; do "
+        f"printf '{RECORD_SEP}%s\\n' \"$s\"; tmux capture-pane -t \"$s\" -p -S -{lines} 2>/dev/null; done"
+    )
+    out = run(script, host=host)
+    if RECORD_SEP not in out:
+        if out.strip():
+            logger.warning(f"{host}: {out.strip()[:200]}")
+        return {}
+    screens = {}
+    for record in out.split(RECORD_SEP)[1:]:
+        session, _, content = record.partition("\n")
+        if content.strip():
+            screens[session] = content
+    return screens
+
+
+def buffer_path(pane: str) -> Path:
+    """Ring buffer file for a pane id like '%3'."""
+    return PANE_BUFFER_DIR / f"{pane.lstrip('%')}.ring"
+
+
+def _drop_buffer(pane: str):
+    ring = _buffers.pop(pane, None)
+    if ring:
+        ring.close()
+
+
+def attach_buffers() -> dict[str, str]:
+    """Pipe every local pane into its ring buffer.
+
+    Returns {session: active pane id}. Panes that already have a pipe are
+    left alone, so this is cheap to call before every capture; buffers of
+    panes that no longer exist are deleted.
+    """
+    out = run("tmux list-panes -a -F '#{pane_id} #{pane_pipe}#{window_active}#{pane_active} #{session_name}' 2>/dev/null")
+    active = {}
+    live = set()
+    for line in out.strip().split('\n'):
+        parts = line.split(" ", 2)
+        if len(parts) != 3 or not parts[0].startswith("%"):
+            continue
+        pane, flags, session = parts
+        live.add(pane)
+        if flags[0] == "0":
+            _drop_buffer(pane)  # writer re-creates the file
+            writer = " ".join(shlex.quote(str(a)) for a in (
+                sys.executable, PANEBUF_SCRIPT, buffer_path(pane), PANE_BUFFER_BYTES))
+            run(f"tmux pipe-pane -o -t {pane} {shlex.quote(writer)}")
+        if flags[1:] == "11":
+            active[session] = pane
+
+    # A timeout or server hiccup lists no panes; deleting every buffer then
+    # would orphan the running writers and lose all history
+    if not live or out.startswith(("[timeout]", "[error")):
+        return active
+    for path in PANE_BUFFER_DIR.glob("*.ring"):
+        pane = f"%{path.stem}"
+        if pane not in live:
+            _drop_buffer(pane)
+            path.unlink(missing_ok=True)
+    return active
+
+
+def read_buffer(pane: str, lines: int = 100) -> str:
+    """Last lines of a pane's ring buffer, '' if it has none yet."""
+    ring = _buffers.get(pane)
+    if ring is None:
+        try:
+            ring = _buffers[pane] = panebuf.RingBuffer(buffer_path(pane))
+        except (OSError, ValueError):
+            return ""
+    return ring.tail(lines)
+
+
+def capture_local(lines: int = 100) -> dict[str, str]:
+    """Capture every session on this machine."""
+    if PANE_BUFFERS:
+        return capture_buffers(lines)
     screens = {}
     for session in list_sessions():
         content = capture_screen(session, lines)
@@ -35,7 +240,97 @@ def get_all_screens(lines: int = 100) -> dict[str, str]:
     return screens
 
 
-def send_keys(keys: str, session: str = None, window: str = None) -> str:
+def capture_buffers(lines: int = 100) -> dict[str, str]:
+    """Capture every local session from the pipe-pane ring buffers.
+
+    One list-panes call, then memory reads. Panes that haven't produced
+    output since they were attached fall back to capture-pane.
+    """
+    screens = {}
+    for session, pane in attach_buffers().items():
+        content = read_buffer(pane, lines)
+        if not content.strip():
+            content = capture_screen(session, lines)
+        if content.strip():
+            screens[session] = content
+    return screens
+
+
+def get_all_screens(lines: int = 100) -> dict[str, str]:
+    """Get screen content from all tmux sessions on all hosts.
+
+    Local sessions are keyed by name, remote ones by 'host:session'.
+    Hosts are captured concurrently.
+    """
+    if not HOSTS:
+        return capture_local(lines)
+
+    with ThreadPoolExecutor(max_workers=len(HOSTS) + 1) as pool:
+        local = pool.submit(capture_local, lines)
+        remote = {host: pool.submit(capture_host, host, lines) for host in HOSTS}
+        screens = local.result()
+        for host, future in remote.items():
+            for session, content in future.result().items():
+                screens[f"{host}:{session}"] = content
+    return screens
+
+
+def cached_screens(lines: int = 100) -> dict[str, str]:
+    """get_all_screens() shared between workers for CAPTURE_CACHE_TTL seconds.
+
+    The first worker to find the cache stale captures while holding the
+    lock; the others wait and then read its result instead of capturing too.
+    """
+    if CAPTURE_CACHE_TTL <= 0:
+        return get_all_screens(lines)
+
+    def fresh():
+        try:
+            if time.time() - CAPTURE_CACHE_FILE.stat().st_mtime < CAPTURE_CACHE_TTL:
+                cached = json.loads(CAPTURE_CACHE_FILE.read_text())
+                if cached.get("lines") == lines:
+                    return cached["screens"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    screens = fresh()
+    if screens is not None:
+        return screens
+    with file_lock("capture"):
+        screens = fresh()
+        if screens is None:
+            generation = cache_generation()
+            screens = get_all_screens(lines)
+            # Keys sent mid-capture make this result stale; don't publish it
+            if cache_generation() == generation:
+                atomic_write(CAPTURE_CACHE_FILE, json.dumps({"lines": lines, "screens": screens}), mode=0o600)
+    return screens
+
+
+def cache_generation() -> str:
+    try:
+        return CAPTURE_CACHE_GEN_FILE.read_text()
+    except OSError:
+        return ""
+
+
+def invalidate_cache():
+    """Drop the shared capture so the next read sees the effect of new input."""
+    atomic_write(CAPTURE_CACHE_GEN_FILE, f"{time.time_ns()}-{os.getpid()}-{threading.get_ident()}")
+    CAPTURE_CACHE_FILE.unlink(missing_ok=True)
+
+
+def group_by_host(screens: dict[str, str]) -> dict[str, dict[str, str]]:
+    """Regroup get_all_screens() output as {host: {session: content}}, '' = local."""
+    groups = {}
+    for key, content in screens.items():
+        host, session, _ = parse_target(key)
+        groups.setdefault(host or "", {})[session or key] = content
+    return groups
+
+
+def send_keys(keys: str, session: str = None, window: str = None, host: str = None) -> str:
     """Send keys to tmux pane."""
     target = ""
     if session:
@@ -44,12 +339,31 @@ def send_keys(keys: str, session: str = None, window: str = None) -> str:
             target = f"-t {session}:{window}"
 
     escaped = keys.replace("'", "'\\''")
-    return run(f"tmux send-keys {target} '{escaped}' Enter 2>/dev/null") or "sent"
+    out = run(f"tmux send-keys {target} '{escaped}' Enter 2>/dev/null", host=host)
+    invalidate_cache()
+    return out or "sent"
+
+
+def send_batch(commands: list[dict]) -> list[str]:
+    """Send one model reply's commands, in order, without interleaving.
+
+    Every target the batch touches is locked (FIFO, across workers) for
+    the whole batch, so another reply's keys can't land between two of
+    ours or overtake an earlier reply. Locks are taken in sorted order so
+    overlapping batches can't deadlock.
+    """
+    parsed = [(cmd["keys"], *parse_target(cmd.get("target", ""))) for cmd in commands if cmd.get("keys")]
+    names = sorted({f"send-{host or 'local'}-{session or ''}" for _, host, session, _ in parsed})
+    with ExitStack() as stack:
+        for name in names:
+            stack.enter_context(fifo_lock(name))
+        return [send_keys(keys, session=session, window=window, host=host)
+                for keys, host, session, window in parsed]
 
 
-def new_session(name: str, cmd: str = None) -> str:
+def new_session(name: str, cmd: str = None, host: str = None) -> str:
     """Create new tmux session."""
     base = f"tmux new-session -d -s {name}"
     if cmd:
         base += f" '{cmd}'"
-    return run(base)
+    return run(base, host=host)
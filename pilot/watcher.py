@@ -0,0 +1,229 @@
+"""Background pane watchers - cheap rules that push notify frames to clients.
+
+Rules live in ~/.pilot/watch.toml:
+
+    [[rule]]
+    name = "tests"
+    type = "regex"                # regex | idle | prompt
+    pattern = '\\d+ (passed|failed)'
+    session = "*"                 # glob on session (or host:session)
+    summarize = false             # ask the model for a one-line summary
+    cooldown = 30                 # seconds before the rule may fire again
+
+regex fires when a line matching pattern appears, idle when a session
+that was changing has been still for idle_seconds, prompt when the last
+line returns to a shell prompt. Only summarize costs a model call.
+"""
+import asyncio
+import fnmatch
+import logging
+import re
+import time
+import tomllib
+from collections import Counter
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+import gemini
+import scheduler
+import tmux
+from config import WATCH_FILE, WATCH_INTERVAL
+
+logger = logging.getLogger("pilot.watcher")
+
+# A prompt char alone ("$ ", "❯ ", ">>> ") or right after a user@host, path
+# or [..]/(..) segment - not "Downloading 45%" or "progress: 100%"
+DEFAULT_PROMPT = r"^(?:.*[@:~/\])]\S*\s?)?(?:[$#%❯]|>{1,3})\s*$"
+
+
+class Rule(BaseModel):
+    """One watch rule from watch.toml."""
+    name: str
+    type: Literal["regex", "idle", "prompt"]
+    pattern: Optional[str] = None
+    session: str = "*"
+    idle_seconds: float = 10
+    cooldown: float = 30
+    message: Optional[str] = Field(default=None, description="notification text instead of the default")
+    summarize: bool = False
+    prompt: Optional[str] = Field(default=None, description="instruction for the summary model call")
+
+    def regex(self) -> re.Pattern:
+        return re.compile(self.pattern or DEFAULT_PROMPT, re.MULTILINE)
+
+
+def load_rules() -> list[Rule]:
+    """Parse watch.toml. Raises on a malformed file."""
+    if not WATCH_FILE.exists():
+        return []
+    data = tomllib.loads(WATCH_FILE.read_text())
+    rules = [Rule(**r) for r in data.get("rule", [])]
+    for rule in rules:
+        if rule.type == "regex" and not rule.pattern:
+            raise ValueError(f"rule {rule.name!r}: regex rules need a pattern")
+        rule.regex()  # fail early on a bad pattern
+    return rules
+
+
+def last_line(content: str) -> str:
+    lines = content.rstrip().split('\n')
+    return lines[-1] if lines else ""
+
+
+class SessionState:
+    """What a watcher remembers about one session between polls."""
+
+    def __init__(self, content: str, now: float):
+        self.content = content
+        self.first_seen = now
+        self.last_change = now
+        self.matches: dict[str, Counter] = {}
+        self.at_prompt: dict[str, bool] = {}
+        self.idle_fired: dict[str, float] = {}
+        self.fired: dict[str, float] = {}
+
+
+class Watcher:
+    """Evaluates rules against successive captures and emits events."""
+
+    def __init__(self, rules: list[Rule] = None):
+        self.rules = rules or []
+        self.sessions: dict[str, SessionState] = {}
+
+    def check(self, screens: dict[str, str], now: float) -> list[dict]:
+        """Update state from one capture; return events for rules that fired."""
+        events = []
+        for session, content in screens.items():
+            content = content.rstrip()
+            state = self.sessions.get(session)
+            seen_before = state is not None
+            if not seen_before:
+                state = self.sessions[session] = SessionState(content, now)
+            elif content != state.content:
+                state.content = content
+                state.last_change = now
+
+            for rule in self.rules:
+                if not fnmatch.fnmatchcase(session, rule.session):
+                    continue
+                detail = self._evaluate(rule, state, seen_before, now)
+                if detail and now - state.fired.get(rule.name, -rule.cooldown) >= rule.cooldown:
+                    state.fired[rule.name] = now
+                    events.append({"rule": rule, "session": session, "detail": detail})
+
+        # Forget sessions that went away
+        for session in set(self.sessions) - set(screens):
+            del self.sessions[session]
+        return events
+
+    def _evaluate(self, rule: Rule, state: SessionState, seen_before: bool, now: float) -> Optional[str]:
+        """Detail text if rule fires for this session now, else None."""
+        if rule.type == "regex":
+            rx = rule.regex()
+            lines = [l.strip() for l in state.content.split('\n') if rx.search(l)]
+            # Count occurrences so a repeat of an identical line ("3 passed"
+            # twice) is news too; the surplus ones are the newest on screen
+            surplus = Counter(lines) - state.matches.get(rule.name, Counter())
+            state.matches[rule.name] = Counter(lines)
+            # Text already on screen at startup is not news
+            if not surplus or not seen_before:
+                return None
+            return next(l for l in reversed(lines) if surplus[l])
+
+        if rule.type == "idle":
+            if (state.last_change > state.first_seen
+                    and now - state.last_change >= rule.idle_seconds
+                    and state.idle_fired.get(rule.name) != state.last_change):
+                state.idle_fired[rule.name] = state.last_change
+                return f"idle for {now - state.last_change:.0f}s after activity"
+            return None
+
+        if rule.type == "prompt":
+            at_prompt = bool(rule.regex().search(last_line(state.content)))
+            was = state.at_prompt.get(rule.name)
+            state.at_prompt[rule.name] = at_prompt
+            return "back at the prompt" if at_prompt and was is False else None
+
+        return None
+
+
+async def summarize(rule: Rule, session: str, content: str) -> Optional[str]:
+    """One-line model summary for a rule that asked for it (background priority)."""
+    text = rule.prompt or f"In one short line, what just happened in session {session}?"
+    try:
+        result = await gemini.translate(
+            text=text,
+            screen={"cols": 60, "rows": 3},
+            tmux_screens={session: content},
+            priority=scheduler.BACKGROUND,
+        )
+    except scheduler.StaleRequest:
+        return None
+    # translate reports failures in the reply rather than raising
+    if (result.get("note") or "").startswith(("error", "missing")):
+        logger.warning(f"Summary for {session} failed: {result.get('note')}")
+        return None
+    # Summaries only report; commands they suggest are never executed
+    return result.get("display")
+
+
+async def notify_frame(event: dict, watcher: Watcher) -> dict:
+    """Build the notify frame sent to clients for one event."""
+    rule, session = event["rule"], event["session"]
+    frame = {
+        "type": "notify",
+        "rule": rule.name,
+        "session": session,
+        "text": rule.message or f"{session}: {event['detail']}",
+    }
+    if rule.summarize:
+        state = watcher.sessions.get(session)
+        summary = await summarize(rule, session, state.content if state else "")
+        if summary:
+            frame["summary"] = summary
+    return frame
+
+
+async def deliver(event: dict, watcher: Watcher, broadcast):
+    """Build and push one event's frame (runs as its own task)."""
+    try:
+        await broadcast(await notify_frame(event, watcher))
+    except Exception as e:
+        logger.error(f"Notify {event['rule'].name} failed: {e}", exc_info=True)
+
+
+async def run(broadcast, has_clients):
+    """Poll forever, reloading watch.toml when it changes.
+
+    broadcast(frame) pushes to every connected client; polling pauses while
+    has_clients() is false since nobody would see the result. Frames are
+    delivered from separate tasks so a slow summary doesn't stall polling.
+    """
+    watcher = Watcher()
+    loaded_mtime = None
+    pending = set()  # keep references so delivery tasks aren't collected
+    while True:
+        await asyncio.sleep(WATCH_INTERVAL)
+        try:
+            mtime = WATCH_FILE.stat().st_mtime if WATCH_FILE.exists() else None
+            if mtime != loaded_mtime:
+                loaded_mtime = mtime
+                try:
+                    watcher = Watcher(load_rules())
+                    logger.info(f"Loaded {len(watcher.rules)} watch rules")
+                except (ValueError, re.error, TypeError) as e:
+                    logger.warning(f"Bad {WATCH_FILE.name}, keeping previous rules: {e}")
+
+            if not watcher.rules or not has_clients():
+                continue
+
+            screens = await asyncio.to_thread(tmux.cached_screens, 100)
+            for event in watcher.check(screens, time.time()):
+                logger.info(f"Watch {event['rule'].name} fired on {event['session']}")
+                task = asyncio.create_task(deliver(event, watcher, broadcast))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Watcher error: {e}", exc_info=True)